@@ -1,19 +1,22 @@
 # === 開頭載入與初始化 ===
-import os, re, requests, logging
+import os, re, requests, logging, hmac
 from urllib.parse import unquote
 from dotenv import load_dotenv
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from pymongo import MongoClient
 import googlemaps
 import datetime
 import pytz
 import urllib.parse
-from linebot.v3 import WebhookHandler
 from linebot.v3.messaging import (
     MessagingApi, Configuration, ApiClient, ReplyMessageRequest
 )
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3.messaging.models import TextMessage
+from linebot.v3.messaging.models import TextMessage, FlexMessage, FlexContainer
+from webhook import ParallelWebhookHandler
+import flex
+from utils import get_sorted_route_url
+from quota import GmapsBudget, QuotaExceeded, INTERACTIVE, BULK, QUOTA_EXCEEDED_REPLY
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -25,14 +28,22 @@ CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
 GOOGLE_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 MONGO_URL = os.getenv("MONGO_URL")
 CWB_API_KEY = os.getenv("CWB_API_KEY")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 logging.info(f"✅ CWB_API_KEY 讀到：{CWB_API_KEY}")
-gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
+gmaps = GmapsBudget(
+    googlemaps.Client(key=GOOGLE_API_KEY),
+    global_rate=float(os.getenv("GMAPS_GLOBAL_RATE", 10)),
+    global_burst=float(os.getenv("GMAPS_GLOBAL_BURST", 50)),
+    user_rate=float(os.getenv("GMAPS_USER_RATE", 0.5)),
+    user_burst=float(os.getenv("GMAPS_USER_BURST", 20)),
+    bulk_reserve=float(os.getenv("GMAPS_BULK_RESERVE", 10)),
+)
 client = MongoClient(MONGO_URL)
 db = client["line_bot_db"]
 collection = db["locations"]
 
 configuration = Configuration(access_token=CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(CHANNEL_SECRET)
+handler = ParallelWebhookHandler(CHANNEL_SECRET, max_workers=int(os.getenv("WEBHOOK_WORKERS", 8)))
 api_instance = MessagingApi(ApiClient(configuration))
 
 # === 指令別名 ===
@@ -65,6 +76,8 @@ def resolve_place_name(user_input):
         result = gmaps.find_place(user_input, "textquery", fields=["name"], language="zh-TW")
         if result.get("candidates"):
             return result["candidates"][0]["name"]
+    except QuotaExceeded:
+        raise
     except Exception as e:
         logging.warning(f"❌ 解析失敗：{e}")
     return "⚠️ 無法解析"
@@ -112,6 +125,7 @@ def handle_message(event):
     user_id = event.source.user_id
     msg = event.message.text.strip()
     reply = ""
+    flex_reply = None  # (alt_text, bubbles)；有值時優先以 Flex carousel 回覆，reply 作為備援文字
 
     items = list(collection.find({"user_id": user_id}).sort("lat", 1))
 
@@ -121,18 +135,13 @@ def handle_message(event):
         if not items:
             reply = "📭 尚未新增任何地點"
         else:
-            lines = []
-            for i, item in enumerate(items):
-                name = clean_place_title(item["name"])
-                lat, lng = item.get("lat"), item.get("lng")
-                nav_link = f"https://www.google.com/maps/dir/?api=1&destination={lat},{lng}" if lat and lng else ""
-                line = f"{i+1}. {name}"
-                if item.get("comment"):
-                    line += f"（{item['comment']}）"
-                if nav_link:
-                    line += f"\n👉 [導航]({nav_link})"
-                lines.append(line)
-            reply = "📍 地點清單：\n" + "\n\n".join(lines)
+            rows = [dict(item, name=clean_place_title(item["name"])) for item in items]
+            routes = [
+                (first, last, len(stops), get_sorted_route_url(stops, GOOGLE_API_KEY))
+                for first, last, stops in flex.route_legs(rows)
+            ]
+            reply = flex.list_text(rows)
+            flex_reply = (f"📍 地點清單（{len(rows)} 筆）", flex.list_bubbles(rows, routes))
 
 
     # 清空
@@ -213,41 +222,52 @@ def handle_message(event):
         if any(lines[0].startswith(k) for k in ADD_ALIASES):
             lines = lines[1:]
 
-        added, duplicate, failed = [], [], []
+        added, duplicate, failed, throttled = [], [], [], []
         existing_names = [doc["name"] for doc in collection.find({"user_id": user_id})]
 
-        for line in lines:
-            name = resolve_place_name(line)
-            if not name or name.startswith("⚠️"):
-                failed.append(line)
-                continue
-            name = clean_place_title(name)
-            if name in existing_names:
-                duplicate.append(name)
-                continue
-            try:
-                geo = gmaps.geocode(name)
-                if geo:
-                    lat = geo[0]["geometry"]["location"]["lat"]
-                    lng = geo[0]["geometry"]["location"]["lng"]
-                    collection.insert_one({
-                        "user_id": user_id,
-                        "name": name,
-                        "lat": lat,
-                        "lng": lng
-                    })
-                else:
-                    collection.insert_one({"user_id": user_id, "name": name})
-                added.append(name)
-                existing_names.append(name)
-            except Exception as e:
-                logging.warning(f"❌ 新增地點錯誤：{e}")
-                failed.append(line)
+        # 單筆新增為互動式，多筆貼上視為批次，額度較低優先
+        priority = BULK if len(lines) > 1 else INTERACTIVE
+        with gmaps.scope(user_id, priority):
+            for pos, line in enumerate(lines):
+                try:
+                    name = resolve_place_name(line)
+                except QuotaExceeded:
+                    throttled = lines[pos:]
+                    break
+                if not name or name.startswith("⚠️"):
+                    failed.append(line)
+                    continue
+                name = clean_place_title(name)
+                if name in existing_names:
+                    duplicate.append(name)
+                    continue
+                try:
+                    geo = gmaps.geocode(name)
+                    if geo:
+                        lat = geo[0]["geometry"]["location"]["lat"]
+                        lng = geo[0]["geometry"]["location"]["lng"]
+                        collection.insert_one({
+                            "user_id": user_id,
+                            "name": name,
+                            "lat": lat,
+                            "lng": lng
+                        })
+                    else:
+                        collection.insert_one({"user_id": user_id, "name": name})
+                    added.append(name)
+                    existing_names.append(name)
+                except QuotaExceeded:
+                    throttled = lines[pos:]
+                    break
+                except Exception as e:
+                    logging.warning(f"❌ 新增地點錯誤：{e}")
+                    failed.append(line)
 
         parts = []
         if added: parts.append("✅ 已新增地點：\n- " + "\n- ".join(added))
         if duplicate: parts.append("⛔️ 重複地點（已略過）：\n- " + "\n- ".join(duplicate))
         if failed: parts.append("⚠️ 無法解析：\n- " + "\n- ".join(failed))
+        if throttled: parts.append(f"{QUOTA_EXCEEDED_REPLY}（未處理）：\n- " + "\n- ".join(throttled))
         reply = "\n\n".join(parts) if parts else "⚠️ 沒有成功加入任何地點"
 
     # === 查詢天氣 ===
@@ -256,66 +276,25 @@ def handle_message(event):
             reply = "📭 尚未新增任何地點"
         else:
             weather_list = []
+            weather_cards = []
+            # 多個地點需要反查行政區時視為批次請求
+            weather_priority = BULK if len(items) > 1 else INTERACTIVE
             for i, loc in enumerate(items):
                 lat = loc.get("lat")
                 lng = loc.get("lng")
                 if lat and lng:
                     try:
-                        geo_result = gmaps.reverse_geocode((lat, lng), language="zh-TW")
-                        district_name = None
-                        town_name = None  # 行政區 level 3
-                        area_name = None  # level 2，例如「台東市」「壽豐鄉」
-                        for comp in geo_result[0]["address_components"]:
-                            if "administrative_area_level_3" in comp["types"]:
-                                town_name = comp["long_name"]
-                            elif "administrative_area_level_2" in comp["types"]:
-                                area_name = comp["long_name"]
-
-                        # 優先使用鄉鎮區，再 fallback 到縣市（level 2）
-                        district_name = town_name or area_name
-                        # 自訂 fallback 對照（可擴充）
-                        fallback_map = {
-                            # 花蓮縣
-                            "花蓮市": "花蓮縣花蓮市",
-                            "新城鄉": "花蓮縣新城鄉",
-                            "秀林鄉": "花蓮縣秀林鄉",
-                            "吉安鄉": "花蓮縣吉安鄉",
-                            "壽豐鄉": "花蓮縣壽豐鄉",
-                            "鳳林鎮": "花蓮縣鳳林鎮",
-                            "光復鄉": "花蓮縣光復鄉",
-                            "豐濱鄉": "花蓮縣豐濱鄉",
-                            "瑞穗鄉": "花蓮縣瑞穗鄉",
-                            "萬榮鄉": "花蓮縣萬榮鄉",
-                            "玉里鎮": "花蓮縣玉里鎮",
-                            "卓溪鄉": "花蓮縣卓溪鄉",
-                            "富里鄉": "花蓮縣富里鄉",
-                        
-                            # 台東縣（注意「臺」非「台」）
-                            "台東市": "臺東縣臺東市",
-                            "成功鎮": "臺東縣成功鎮",
-                            "關山鎮": "臺東縣關山鎮",
-                            "長濱鄉": "臺東縣長濱鄉",
-                            "池上鄉": "臺東縣池上鄉",
-                            "東河鄉": "臺東縣東河鄉",
-                            "鹿野鄉": "臺東縣鹿野鄉",
-                            "卑南鄉": "臺東縣卑南鄉",
-                            "大武鄉": "臺東縣大武鄉",
-                            "太麻里鄉": "臺東縣太麻里鄉",
-                            "綠島鄉": "臺東縣綠島鄉",
-                            "延平鄉": "臺東縣延平鄉",
-                            "金峰鄉": "臺東縣金峰鄉",
-                            "海端鄉": "臺東縣海端鄉",
-                            "達仁鄉": "臺東縣達仁鄉",
-                            "蘭嶼鄉": "臺東縣蘭嶼鄉"
-                        }
-
-
-# 若目前 district_name 是錯的細分名，則使用對照表修正
-                        if district_name in fallback_map:
-                            district_name = fallback_map[district_name]
+                        # 行政區存回資料庫，之後查天氣不必再反查，也不再消耗地圖額度
+                        district_name = loc.get("district")
+                        if not district_name:
+                            with gmaps.scope(user_id, weather_priority):
+                                district_name = resolve_district(lat, lng)
+                            if district_name:
+                                collection.update_one({"_id": loc["_id"]}, {"$set": {"district": district_name}})
 
                         if not district_name:
                             weather_list.append(f"⚠️ {i+1}. {loc['name']} 查無行政區")
+                            weather_cards.append({"text": weather_list[-1]})
                             continue
 
                         title = clean_place_title(loc["name"])
@@ -325,24 +304,55 @@ def handle_message(event):
 
                         forecast = get_weather_by_district(district_name)
                         if forecast:
-                            weather_list.append(
-                                f"📌 {i+1}. {title}（{district_name}）\n🔍 使用行政區：{district_name}\n{rain_1hr_txt}　{temp_txt}\n{forecast}"
-                            )
+                            weather_cards.append({
+                                "index": i + 1, "title": title, "district": district_name,
+                                "now": f"{rain_1hr_txt}　{temp_txt}", "forecast": forecast,
+                            })
+                            weather_list.append(flex.weather_text(weather_cards[-1:]))
                         else:
-                            f"⚠️ {i+1}. {title}（{district_name}） 查無天氣預報\n🔍 使用行政區：{district_name}"
+                            weather_list.append(f"⚠️ {i+1}. {title}（{district_name}） 查無天氣預報\n🔍 使用行政區：{district_name}")
+                            weather_cards.append({"text": weather_list[-1]})
 
+                    except QuotaExceeded:
+                        weather_list.append(f"{QUOTA_EXCEEDED_REPLY}（第 {i+1} 筆起未查詢）")
+                        weather_cards.append({"text": weather_list[-1]})
+                        break
                     except Exception as e:
                         logging.warning(f"❌ 天氣查詢錯誤：{e}")
                         weather_list.append(f"⚠️ {i+1}. {loc['name']} 查詢失敗")
+                        weather_cards.append({"text": weather_list[-1]})
                 else:
                     weather_list.append(f"⚠️ {i+1}. {loc['name']} 缺少經緯度")
+                    weather_cards.append({"text": weather_list[-1]})
 
             reply = "\n\n".join(weather_list)
+            flex_reply = (f"🌤️ 天氣（{len(items)} 個地點）", flex.weather_bubbles(weather_cards))
 
 
 
 
     # 回覆訊息
+    if flex_reply:
+        alt, bubbles = flex_reply
+        carousels, dropped = flex.paginate(bubbles)
+        if dropped:
+            # 最後一則留給提示文字
+            carousels, _ = flex.paginate(bubbles, flex.MAX_REPLY_MESSAGES - 1)
+        try:
+            # 建立 FlexContainer 也可能失敗（例如驗證錯誤），一併改走文字備援
+            messages = [
+                FlexMessage(alt_text=flex.alt_text(alt), contents=FlexContainer.from_dict(c))
+                for c in carousels
+            ]
+            if dropped:
+                shown = sum(len(c["contents"]) for c in carousels)
+                messages.append(TextMessage(text=f"⚠️ 內容過多，僅顯示前 {shown} 張卡片"))
+            api_instance.reply_message(
+                ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+            )
+            reply = ""
+        except Exception as e:
+            logging.warning(f"❌ Flex 回覆錯誤，改用文字：{e}")
     if reply:
         try:
             api_instance.reply_message(
@@ -350,6 +360,63 @@ def handle_message(event):
             )
         except Exception as e:
             logging.warning(f"❌ 回覆訊息錯誤：{e}")
+def resolve_district(lat, lng):
+    """以經緯度反查天氣預報用的行政區名稱，查無時回傳 None"""
+    geo_result = gmaps.reverse_geocode((lat, lng), language="zh-TW")
+    district_name = None
+    town_name = None  # 行政區 level 3
+    area_name = None  # level 2，例如「台東市」「壽豐鄉」
+    for comp in geo_result[0]["address_components"]:
+        if "administrative_area_level_3" in comp["types"]:
+            town_name = comp["long_name"]
+        elif "administrative_area_level_2" in comp["types"]:
+            area_name = comp["long_name"]
+
+    # 優先使用鄉鎮區，再 fallback 到縣市（level 2）
+    district_name = town_name or area_name
+    # 自訂 fallback 對照（可擴充）
+    fallback_map = {
+        # 花蓮縣
+        "花蓮市": "花蓮縣花蓮市",
+        "新城鄉": "花蓮縣新城鄉",
+        "秀林鄉": "花蓮縣秀林鄉",
+        "吉安鄉": "花蓮縣吉安鄉",
+        "壽豐鄉": "花蓮縣壽豐鄉",
+        "鳳林鎮": "花蓮縣鳳林鎮",
+        "光復鄉": "花蓮縣光復鄉",
+        "豐濱鄉": "花蓮縣豐濱鄉",
+        "瑞穗鄉": "花蓮縣瑞穗鄉",
+        "萬榮鄉": "花蓮縣萬榮鄉",
+        "玉里鎮": "花蓮縣玉里鎮",
+        "卓溪鄉": "花蓮縣卓溪鄉",
+        "富里鄉": "花蓮縣富里鄉",
+
+        # 台東縣（注意「臺」非「台」）
+        "台東市": "臺東縣臺東市",
+        "成功鎮": "臺東縣成功鎮",
+        "關山鎮": "臺東縣關山鎮",
+        "長濱鄉": "臺東縣長濱鄉",
+        "池上鄉": "臺東縣池上鄉",
+        "東河鄉": "臺東縣東河鄉",
+        "鹿野鄉": "臺東縣鹿野鄉",
+        "卑南鄉": "臺東縣卑南鄉",
+        "大武鄉": "臺東縣大武鄉",
+        "太麻里鄉": "臺東縣太麻里鄉",
+        "綠島鄉": "臺東縣綠島鄉",
+        "延平鄉": "臺東縣延平鄉",
+        "金峰鄉": "臺東縣金峰鄉",
+        "海端鄉": "臺東縣海端鄉",
+        "達仁鄉": "臺東縣達仁鄉",
+        "蘭嶼鄉": "臺東縣蘭嶼鄉"
+    }
+
+
+    # 若目前 district_name 是錯的細分名，則使用對照表修正
+    if district_name in fallback_map:
+        district_name = fallback_map[district_name]
+    return district_name
+
+
 def get_weather_by_district(district_name):
     """查詢今明天氣預報（F-D0047-091）"""
     try:
@@ -437,6 +504,24 @@ def get_rain_temp_1hr_by_location(district_name):
 def ping():
     return "pong", 200
 
+# 管理用端點：需帶 X-Admin-Token，未設定 ADMIN_TOKEN 時一律拒絕
+def require_admin():
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        abort(403)
+
+# Google Maps 配額用量（容量規劃用）
+@app.route("/quota", methods=["GET"])
+def quota_usage():
+    require_admin()
+    return jsonify(gmaps.snapshot()), 200
+
+# Webhook 事件延遲（收到請求到事件處理完成）
+@app.route("/webhook/latency", methods=["GET"])
+def webhook_latency():
+    require_admin()
+    return jsonify(handler.latency.snapshot()), 200
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port, debug=True)
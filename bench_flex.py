@@ -0,0 +1,97 @@
+# === Flex 渲染 benchmark ===
+# 比較「清單」「天氣」回覆的純文字路徑、舊的每次讀檔 + deepcopy 做法，與預先編譯模板的渲染時間與 payload 大小。
+# 用法：python bench_flex.py [地點數量]
+import os
+import sys
+import json
+import copy
+import time
+
+import flex
+
+
+def make_items(n):
+    return [
+        {"name": f"測試地點{i}", "comment": "必吃｜早點去" if i % 3 == 0 else "",
+         "lat": 23.9 + i * 0.001, "lng": 121.6 + i * 0.001}
+        for i in range(n)
+    ]
+
+
+def make_cards(n):
+    return [
+        {"index": i + 1, "title": f"測試地點{i}", "district": "花蓮縣花蓮市",
+         "now": "🌧️ 1 小時降雨 20%　🌡️ 溫度 27°C",
+         "forecast": "今天 ☀️ 晴時多雲　🌡️ 24°C / 31°C　🌧️ 降雨機率 20%\n"
+                     "明天 ☀️ 多雲　🌡️ 25°C / 30°C　🌧️ 降雨機率 30%"}
+        for i in range(n)
+    ]
+
+
+def naive_list_bubbles(items):
+    """舊做法：每次從磁碟讀模板並 deepcopy 後填值"""
+    with open(os.path.join(flex.BASE_DIR, flex.TEMPLATE_BUNDLE), "r", encoding="utf-8") as f:
+        templates = json.load(f)
+    bubbles = []
+    for start in range(0, len(items), flex.LIST_ROWS_PER_BUBBLE):
+        bubble = copy.deepcopy(templates["list_bubble"])
+        chunk = items[start:start + flex.LIST_ROWS_PER_BUBBLE]
+        bubble["header"]["contents"][0]["text"] = f"📍 地點清單 {start + 1}–{start + len(chunk)}"
+        rows = []
+        for i, item in enumerate(chunk, start + 1):
+            row = copy.deepcopy(templates["list_row"])
+            row["contents"][0]["text"] = f"{i}. {item['name']}"
+            row["contents"].pop()
+            if item["comment"]:
+                comment = copy.deepcopy(templates["list_comment"])
+                comment["text"] = f"📝 {item['comment']}"
+                row["contents"].append(comment)
+            nav = copy.deepcopy(templates["list_nav"])
+            nav["action"]["uri"] = flex.nav_url(item["lat"], item["lng"])
+            row["contents"].append(nav)
+            rows.append(row)
+        bubble["body"]["contents"] = rows
+        bubbles.append(bubble)
+    return bubbles
+
+
+def timeit(fn, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def text_size(text):
+    return len(json.dumps({"type": "text", "text": text}))
+
+
+def flex_size(bubbles):
+    carousels, dropped = flex.paginate(bubbles)
+    return sum(flex.payload_size(c) for c in carousels), len(carousels), dropped
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    items, cards = make_items(n), make_cards(n)
+
+    rows = [
+        ("清單 文字", lambda: flex.list_text(items), text_size),
+        ("清單 讀檔+deepcopy", lambda: naive_list_bubbles(items), flex_size),
+        ("清單 預編譯 Flex", lambda: flex.list_bubbles(items), flex_size),
+        ("天氣 文字", lambda: flex.weather_text(cards), text_size),
+        ("天氣 預編譯 Flex", lambda: flex.weather_bubbles(cards), flex_size),
+    ]
+    print(f"地點數量：{n}")
+    for label, fn, size_fn in rows:
+        ms, result = timeit(fn)
+        size = size_fn(result)
+        if isinstance(size, tuple):
+            total, pages, dropped = size
+            print(f"{label:<16} {ms:8.3f} ms  {total:7d} bytes  {pages} 則 carousel，略過 {dropped} 張")
+        else:
+            print(f"{label:<16} {ms:8.3f} ms  {size:7d} bytes")
+
+
+if __name__ == "__main__":
+    main()
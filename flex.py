@@ -0,0 +1,266 @@
+# === Flex Message 渲染 ===
+# 啟動時載入並驗證模板，編譯成可重複使用的結構：
+# 不含變數的子樹直接共用，只有含 {{變數}} 的節點在每次渲染時重建，不需 deepcopy 整份模板。
+# 語法：字串中的 {{name}} 代入值；陣列元素 "{{*name}}" 展開為傳入的元件清單。
+#
+# ⚠️ 渲染結果一律視為唯讀：靜態子樹（以及完全沒有變數的模板，例如 menu）回傳的是編譯後模板本身的參照，
+# 修改結果（例如對 contents append）會污染整個行程共用的模板。需要修改請先自行複製。
+import os
+import re
+import json
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_FILES = {
+    "menu": "flex_message_template.json",
+}
+TEMPLATE_BUNDLE = "flex_templates.json"
+
+# LINE 限制
+MAX_CAROUSEL_BUBBLES = 12
+MAX_CONTAINER_BYTES = 50 * 1024
+# 預留給訊息外框（type / altText 等）的空間
+CONTAINER_SAFETY_MARGIN = 2 * 1024
+MAX_REPLY_MESSAGES = 5
+MAX_ALT_TEXT = 400
+MAX_URI_LENGTH = 1000
+LIST_ROWS_PER_BUBBLE = 5
+# Google 地圖路線網址：起點 + 最多 9 個中途點 + 終點
+MAX_ROUTE_STOPS = 11
+
+_VAR = re.compile(r"\{\{(\w+)\}\}")
+_SPLICE = re.compile(r"^\{\{\*(\w+)\}\}$")
+_CONTAINER_TYPES = {"bubble", "carousel"}
+
+
+class TemplateError(ValueError):
+    """Flex 模板格式錯誤"""
+
+
+class CompiledTemplate:
+    def __init__(self, name, source):
+        self.name = name
+        self.variables = set()
+        self.static, self._node = self._compile(source, name)
+
+    def render(self, /, **values):
+        """回傳結果與模板共用靜態子樹，呼叫端不可修改"""
+        missing = self.variables - values.keys()
+        if missing:
+            raise KeyError(f"{self.name} 缺少變數：{', '.join(sorted(missing))}")
+        return self._node if self.static else self._node(values)
+
+    # 回傳 (是否靜態, 原節點或渲染函式)
+    def _compile(self, node, path):
+        if isinstance(node, str):
+            return self._compile_str(node, path)
+        if isinstance(node, dict):
+            return self._compile_dict(node, path)
+        if isinstance(node, list):
+            return self._compile_list(node, path)
+        return True, node
+
+    def _compile_str(self, text, path):
+        if _SPLICE.match(text):
+            raise TemplateError(f"{path}：{text} 只能作為陣列元素")
+        parts = _VAR.split(text)
+        if len(parts) == 1:
+            return True, text
+        # parts 交錯為 [文字, 變數, 文字, 變數, ...]
+        names = parts[1::2]
+        self.variables.update(names)
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            name = names[0]
+            return False, lambda v: str(v[name])
+        return False, lambda v: "".join(
+            p if i % 2 == 0 else str(v[p]) for i, p in enumerate(parts)
+        )
+
+    def _compile_dict(self, node, path):
+        if "type" not in node:
+            raise TemplateError(f"{path}：元件缺少 type")
+        if node["type"] == "text" and not node.get("text"):
+            raise TemplateError(f"{path}：text 元件內容不可為空")
+        static_items, dynamic = {}, []
+        for key, child in node.items():
+            is_static, compiled = self._compile(child, f"{path}.{key}")
+            if is_static:
+                static_items[key] = child
+            else:
+                dynamic.append((key, compiled))
+        if not dynamic:
+            return True, node
+
+        def render(v):
+            out = dict(static_items)
+            for key, fn in dynamic:
+                out[key] = fn(v)
+            return out
+        return False, render
+
+    def _compile_list(self, node, path):
+        steps, all_static = [], True
+        for i, child in enumerate(node):
+            splice = _SPLICE.match(child) if isinstance(child, str) else None
+            if splice:
+                self.variables.add(splice.group(1))
+                steps.append(("splice", splice.group(1)))
+                all_static = False
+                continue
+            is_static, compiled = self._compile(child, f"{path}[{i}]")
+            steps.append(("static", child) if is_static else ("dynamic", compiled))
+            all_static = all_static and is_static
+        if all_static:
+            return True, node
+
+        def render(v):
+            out = []
+            for kind, item in steps:
+                if kind == "static":
+                    out.append(item)
+                elif kind == "dynamic":
+                    out.append(item(v))
+                else:
+                    out.extend(v[item])
+            return out
+        return False, render
+
+
+def _load_json(filename):
+    with open(os.path.join(BASE_DIR, filename), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_templates():
+    sources = {name: _load_json(fn) for name, fn in TEMPLATE_FILES.items()}
+    sources.update(_load_json(TEMPLATE_BUNDLE))
+    templates = {name: CompiledTemplate(name, src) for name, src in sources.items()}
+    for name in TEMPLATE_FILES:
+        if sources[name]["type"] not in _CONTAINER_TYPES:
+            raise TemplateError(f"{name}：最外層必須是 bubble 或 carousel")
+    for name, src in sources.items():
+        if name.endswith("_bubble") and src["type"] != "bubble":
+            raise TemplateError(f"{name}：必須是 bubble")
+    return templates
+
+
+# 模組載入時即編譯，模板有誤會在啟動時失敗
+TEMPLATES = load_templates()
+
+
+def render(template, /, **values):
+    return TEMPLATES[template].render(**values)
+
+
+def payload_size(container):
+    """與 SDK 送出時相同的序列化方式（json.dumps 預設 ensure_ascii=True），
+    中文字會變成 \\uXXXX 六個位元組、emoji 為十二個位元組"""
+    return len(json.dumps(container))
+
+
+def paginate(bubbles, max_messages=MAX_REPLY_MESSAGES):
+    """把 bubble 切成符合 LINE 限制的 carousel；回傳 (carousel 清單, 放不下的 bubble 數)"""
+    pages, current, current_size = [], [], 0
+    # carousel 外框與 bubble 間的 ", " 分隔
+    overhead = payload_size({"type": "carousel", "contents": []})
+    limit = MAX_CONTAINER_BYTES - CONTAINER_SAFETY_MARGIN
+    for bubble in bubbles:
+        size = payload_size(bubble) + 2
+        if current and (len(current) >= MAX_CAROUSEL_BUBBLES or
+                        overhead + current_size + size > limit):
+            pages.append(current)
+            current, current_size = [], 0
+        current.append(bubble)
+        current_size += size
+    if current:
+        pages.append(current)
+
+    kept = pages[:max_messages]
+    dropped = sum(len(p) for p in pages[max_messages:])
+    return [{"type": "carousel", "contents": p} for p in kept], dropped
+
+
+def alt_text(text):
+    return text if len(text) <= MAX_ALT_TEXT else text[:MAX_ALT_TEXT - 1] + "…"
+
+
+# === 各回覆的 bubble ===
+def nav_url(lat, lng):
+    return f"https://www.google.com/maps/dir/?api=1&destination={lat},{lng}"
+
+
+def route_legs(items):
+    """把有經緯度的地點依清單順序切成多段路線，每段最多 MAX_ROUTE_STOPS 個點，前後段共用銜接點。
+    回傳 [(起始編號, 結束編號, [(name, lat, lng), ...])]，編號為清單中的序號"""
+    located = [(i + 1, (item["name"], item["lat"], item["lng"]))
+               for i, item in enumerate(items) if item.get("lat") and item.get("lng")]
+    legs = []
+    for start in range(0, len(located) - 1, MAX_ROUTE_STOPS - 1):
+        chunk = located[start:start + MAX_ROUTE_STOPS]
+        legs.append((chunk[0][0], chunk[-1][0], [stop for _, stop in chunk]))
+    return legs
+
+
+def list_bubbles(items, routes=None):
+    """items：[{"name", "comment", "lat", "lng"}]，name 需已清理；
+    routes：[(起始編號, 結束編號, 地點數, 網址)]，網址超過 LINE 長度上限的路線會略過"""
+    rows = []
+    for i, item in enumerate(items):
+        extra = []
+        if item.get("comment"):
+            extra.append(render("list_comment", comment=item["comment"]))
+        lat, lng = item.get("lat"), item.get("lng")
+        if lat and lng:
+            extra.append(render("list_nav", uri=nav_url(lat, lng)))
+        rows.append(render("list_row", index=i + 1, name=item["name"], extra=extra))
+
+    bubbles = []
+    for start in range(0, len(rows), LIST_ROWS_PER_BUBBLE):
+        chunk = rows[start:start + LIST_ROWS_PER_BUBBLE]
+        bubbles.append(render("list_bubble", first=start + 1, last=start + len(chunk), rows=chunk))
+    for first, last, count, uri in routes or []:
+        if len(uri) <= MAX_URI_LENGTH:
+            bubbles.append(render("route_bubble", first=first, last=last, count=count, uri=uri))
+    return bubbles
+
+
+def weather_bubbles(cards):
+    """cards：[{"index", "title", "district", "now", "forecast"}] 或 [{"text"}]（錯誤提示）"""
+    bubbles = []
+    for card in cards:
+        if "text" in card:
+            bubbles.append(render("notice_bubble", text=card["text"]))
+            continue
+        lines = [render("weather_line", line=line) for line in card["forecast"].splitlines() if line]
+        bubbles.append(render(
+            "weather_bubble",
+            index=card["index"], title=card["title"], district=card["district"],
+            now=card["now"], forecast=lines,
+        ))
+    return bubbles
+
+
+# === 純文字版本（Flex 失敗時的備援，也用於 benchmark） ===
+def list_text(items):
+    lines = []
+    for i, item in enumerate(items):
+        line = f"{i+1}. {item['name']}"
+        if item.get("comment"):
+            line += f"（{item['comment']}）"
+        lat, lng = item.get("lat"), item.get("lng")
+        if lat and lng:
+            line += f"\n👉 [導航]({nav_url(lat, lng)})"
+        lines.append(line)
+    return "📍 地點清單：\n" + "\n\n".join(lines)
+
+
+def weather_text(cards):
+    parts = []
+    for card in cards:
+        if "text" in card:
+            parts.append(card["text"])
+        else:
+            parts.append(
+                f"📌 {card['index']}. {card['title']}（{card['district']}）\n"
+                f"🔍 使用行政區：{card['district']}\n{card['now']}\n{card['forecast']}"
+            )
+    return "\n\n".join(parts)
@@ -0,0 +1,165 @@
+# === Google Maps 配額管理 ===
+# 包住 googlemaps.Client，用全域 + 每位使用者的 token bucket 控制呼叫量，
+# 互動式單筆新增優先於批次新增，超出額度時丟出 QuotaExceeded。
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+QUOTA_EXCEEDED_REPLY = "⏳ 地圖查詢次數過多，請稍後再試"
+
+
+class QuotaExceeded(Exception):
+    """Google Maps 額度不足（全域或單一使用者）"""
+
+    def __init__(self, scope, user_id=None):
+        super().__init__(f"Google Maps 額度不足：{scope}")
+        self.scope = scope
+        self.user_id = user_id
+
+
+class TokenBucket:
+    """每秒補充 rate 個 token，最多累積 capacity 個"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_take(self, n=1, reserve=0):
+        """取出 n 個 token；取完後至少要剩 reserve 個，否則失敗"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens - n < reserve:
+                return False
+            self.tokens -= n
+            return True
+
+    def give_back(self, n=1):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def level(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class GmapsBudget:
+    """帶配額的 gmaps 包裝，介面與 googlemaps.Client 的 find_place / geocode / reverse_geocode 相同"""
+
+    BUDGETED_METHODS = ("find_place", "geocode", "reverse_geocode")
+    MAX_USER_BUCKETS = 1000
+
+    def __init__(self, client, global_rate=10, global_burst=50,
+                 user_rate=0.5, user_burst=20, bulk_reserve=10):
+        self._client = client
+        self._global = TokenBucket(global_rate, global_burst)
+        self._user_rate = user_rate
+        self._user_burst = user_burst
+        # 批次請求不能把全域 bucket 用到低於此數，保留給互動式單筆操作
+        self._bulk_reserve = min(bulk_reserve, global_burst)
+        self._users = OrderedDict()  # 依最近使用排序，超過上限時淘汰最久未用者
+        self._users_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._started = time.time()
+        self._calls = {m: 0 for m in self.BUDGETED_METHODS}
+        self._allowed = {INTERACTIVE: 0, BULK: 0}
+        self._rejected = {"global": 0, "user": 0}
+
+    # === 呼叫情境（使用者 / 優先權） ===
+    @contextmanager
+    def scope(self, user_id, priority=INTERACTIVE):
+        previous = getattr(self._local, "current", None)
+        self._local.current = (user_id, priority)
+        try:
+            yield self
+        finally:
+            self._local.current = previous
+
+    def _current(self):
+        return getattr(self._local, "current", None) or (None, INTERACTIVE)
+
+    def _user_bucket(self, user_id):
+        with self._users_lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                if len(self._users) >= self.MAX_USER_BUCKETS:
+                    self._users.popitem(last=False)
+                bucket = self._users[user_id] = TokenBucket(self._user_rate, self._user_burst)
+            else:
+                self._users.move_to_end(user_id)
+            return bucket
+
+    def _acquire(self, method):
+        user_id, priority = self._current()
+        user_bucket = self._user_bucket(user_id) if user_id else None
+
+        if user_bucket and not user_bucket.try_take():
+            self._record_reject("user", user_id, method)
+            raise QuotaExceeded("user", user_id)
+
+        reserve = self._bulk_reserve if priority == BULK else 0
+        if not self._global.try_take(reserve=reserve):
+            if user_bucket:
+                user_bucket.give_back()
+            self._record_reject("global", user_id, method)
+            raise QuotaExceeded("global", user_id)
+
+        with self._stats_lock:
+            self._calls[method] += 1
+            self._allowed[priority] = self._allowed.get(priority, 0) + 1
+
+    def _record_reject(self, scope, user_id, method):
+        with self._stats_lock:
+            self._rejected[scope] += 1
+        logging.warning(f"⏳ Google Maps 額度不足（{scope}）：{method} user={user_id}")
+
+    # === 受配額控管的 API ===
+    def find_place(self, *args, **kwargs):
+        self._acquire("find_place")
+        return self._client.find_place(*args, **kwargs)
+
+    def geocode(self, *args, **kwargs):
+        self._acquire("geocode")
+        return self._client.geocode(*args, **kwargs)
+
+    def reverse_geocode(self, *args, **kwargs):
+        self._acquire("reverse_geocode")
+        return self._client.reverse_geocode(*args, **kwargs)
+
+    # === 用量統計 ===
+    def snapshot(self):
+        """只回傳彙總數字，不含使用者 ID"""
+        with self._stats_lock:
+            stats = {
+                "uptime_seconds": round(time.time() - self._started, 1),
+                "calls": dict(self._calls),
+                "calls_total": sum(self._calls.values()),
+                "allowed_by_priority": dict(self._allowed),
+                "rejected": dict(self._rejected),
+            }
+        with self._users_lock:
+            stats["tracked_users"] = len(self._users)
+        stats["global_tokens"] = round(self._global.level(), 2)
+        stats["limits"] = {
+            "global_rate": self._global.rate,
+            "global_burst": self._global.capacity,
+            "user_rate": self._user_rate,
+            "user_burst": self._user_burst,
+            "bulk_reserve": self._bulk_reserve,
+        }
+        return stats
@@ -1,9 +1,10 @@
 import googlemaps
 import requests
-import json
-from linebot.v3.messaging.models import FlexMessage
+from linebot.v3.messaging.models import FlexMessage, FlexContainer
 from linebot.models import FlexSendMessage  # 用於 fallback
 from pymongo.collection import Collection
+import flex
+from quota import QuotaExceeded
 
 def get_coordinates(query, gmaps):
     try:
@@ -11,11 +12,14 @@ def get_coordinates(query, gmaps):
         if results:
             location = results[0]["geometry"]["location"]
             return {"lat": location["lat"], "lng": location["lng"]}
-    except:
+    except QuotaExceeded:
+        raise
+    except Exception:
         return None
 
 def get_sorted_route_url(locations, api_key):
-    waypoints = "|".join([f"{lat},{lng}" for _, lat, lng in locations[1:-1]])
+    # 分隔符號 | 需編碼，LINE 的 URI action 不接受未編碼字元
+    waypoints = "%7C".join([f"{lat},{lng}" for _, lat, lng in locations[1:-1]])
     origin = f"{locations[0][1]},{locations[0][2]}"
     dest = f"{locations[-1][1]},{locations[-1][2]}"
     url = (
@@ -40,7 +44,9 @@ def extract_location_from_url(short_url, gmaps):
                 "name": place_name.replace("+", " "),
                 **get_coordinates(place_name.replace("+", " "), gmaps)
             }
-    except:
+    except QuotaExceeded:
+        raise
+    except Exception:
         return None
 
 def show_location_list(user_id, collection: Collection):
@@ -63,9 +69,8 @@ def add_location(user_id, name, lat, lng, collection: Collection):
     return f"✅ 已加入地點：{name}"
 
 def create_flex_message():
-    with open("flex_message_template.json", "r", encoding="utf-8") as f:
-        contents = json.load(f)
-    return FlexMessage(alt_text="指令選單", contents=contents)
+    # 模板已在 flex 模組載入時編譯，不再每次讀檔
+    return FlexMessage(alt_text="指令選單", contents=FlexContainer.from_dict(flex.render("menu")))
 def add_location_note(user_id, index, note, collection):
     docs = list(collection.find({"user_id": user_id}))
     if index < 1 or index > len(docs):
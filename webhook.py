@@ -0,0 +1,156 @@
+# === 多事件 Webhook 平行處理 ===
+# 同一個 webhook 請求裡的事件依來源（user / group / room）分組：
+# 不同來源平行處理，同一來源維持原本順序。
+# handle_message 以 user_id 讀寫地點清單，所以共用同一個 user_id 的來源會併成一組依序處理。
+import time
+import inspect
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.webhooks import MessageEvent
+
+
+def source_key(event):
+    """事件來源的分組鍵：群組 / 聊天室優先，否則使用者"""
+    source = getattr(event, "source", None)
+    if source is None:
+        return ("none", None)
+    for kind, attr in (("group", "group_id"), ("room", "room_id"), ("user", "user_id")):
+        value = getattr(source, attr, None)
+        if value:
+            return (kind, value)
+    return ("none", None)
+
+
+def group_events(events):
+    """依來源分組；同一聊天室或同一 user_id 的事件會落在同一組，組內保持原順序"""
+    parent = {}
+
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    keyed = []
+    for event in events:
+        key = source_key(event)
+        user_id = getattr(getattr(event, "source", None), "user_id", None)
+        if user_id:
+            parent[find(key)] = find(("user", user_id))
+        keyed.append((key, event))
+
+    groups = OrderedDict()
+    for key, event in keyed:
+        groups.setdefault(find(key), []).append(event)
+    return groups
+
+
+class LatencyTracker:
+    """保留最近 window 筆事件延遲（秒），計算百分位數"""
+
+    def __init__(self, window=1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+        if not samples:
+            return {"events_total": count, "window": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            "events_total": count,
+            "window": len(samples),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": round(samples[-1] * 1000, 1),
+        }
+
+
+class ParallelWebhookHandler(WebhookHandler):
+    """WebhookHandler 的平行版本，註冊方式（@handler.add）完全相同"""
+
+    def __init__(self, channel_secret, max_workers=8):
+        super().__init__(channel_secret)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="webhook")
+        self.latency = LatencyTracker()
+
+    def handle(self, body, signature):
+        received = time.monotonic()
+        payload = self.parser.parse(body, signature, as_payload=True)
+
+        groups = group_events(payload.events)
+
+        if len(groups) <= 1:
+            # 單一來源不需要開執行緒
+            for events in groups.values():
+                self._run_source(events, payload.destination, received)
+        else:
+            futures = [
+                self.executor.submit(self._run_source, events, payload.destination, received)
+                for events in groups.values()
+            ]
+            errors = [f.exception() for f in futures]
+            errors = [e for e in errors if e is not None]
+            if errors:
+                raise errors[0]
+
+        if payload.events:
+            logging.info(
+                f"⏱️ webhook 處理完成：{len(payload.events)} 個事件 / {len(groups)} 個來源，"
+                f"耗時 {(time.monotonic() - received) * 1000:.0f} ms"
+            )
+
+    def _run_source(self, events, destination, received):
+        """依序處理同一來源的事件；任一事件失敗仍繼續處理後面的事件，最後再拋出"""
+        first_error = None
+        for event in events:
+            try:
+                self._dispatch(event, destination)
+            except Exception as e:
+                logging.error(f"❌ 事件處理錯誤（{source_key(event)[0]}）：{e}")
+                first_error = first_error or e
+            finally:
+                self.latency.record(time.monotonic() - received)
+        if first_error:
+            raise first_error
+
+    def _dispatch(self, event, destination):
+        """與 WebhookHandler.handle 相同的 handler 查找順序"""
+        func = None
+        key = None
+        if isinstance(event, MessageEvent):
+            key = f"{event.__class__.__name__}_{event.message.__class__.__name__}"
+            func = self._handlers.get(key)
+        if func is None:
+            key = event.__class__.__name__
+            func = self._handlers.get(key)
+        if func is None:
+            func = self._default
+        if func is None:
+            logging.info(f"No handler of {key} and no default handler")
+            return
+
+        spec = inspect.getfullargspec(func)
+        if spec.varargs or len(spec.args) == 2:
+            func(event, destination)
+        elif len(spec.args) == 1:
+            func(event)
+        else:
+            func()